@@ -10,30 +10,162 @@ If the target is acquired, evolution will stop.
 import numpy as np
 from tqdm import tqdm
 
-def generate_random_dna(N, target):
+try:
+    from numba import njit, prange
+except ImportError:
+    # numba is optional, without it each generation runs as separate NumPy steps
+    njit = None
+
+def generate_random_dna(N, alphabet, rng):
     """
     Function to randomly generate DNA elements
     DNA elements will be randomly generated from the ASCII characters that are present in the target string
 
-    :param N: number of DNA elements to generate
-    :type N: int
-    :param target: target string to match
-    :type target: str
-    :return: DNA string randomly generated
-    :rtype: str
+    :param N: number of DNA elements to generate, or a shape tuple to generate a matrix of them
+    :type N: int or tuple
+    :param alphabet: ASCII codes of the characters in the target string
+    :type alphabet: np.ndarray
+    :param rng: random generator to draw with
+    :type rng: np.random.Generator
+    :return: DNA randomly generated, as ASCII codes
+    :rtype: np.ndarray
     """
-    dna_elements = []
-    for i in range(0, len(target)):
-        # ord takes the ASCII number of each character in the target string
-        elem = ord(target[i])
-        dna_elements.append(elem)
-    # randomly generated ASCII characters
-    dna_nums = list(np.random.choice(dna_elements, N))
-    dna = ""
-    for elem in dna_nums:
-        # chr converts the ASCII character back into a str
-        dna = dna + chr(int(elem))
-    return dna
+    return alphabet[rng.integers(0, alphabet.size, size=N)]
+
+
+if njit is not None:
+    @njit(inline='always')
+    def _crossover(parentA, parentB, target, babyA, babyB):
+        """
+        Writes the two babies of a pair of parents
+        the loop is a branch free compare and blend, which LLVM can vectorize to SIMD compare and blend
+        """
+        for i in range(target.shape[0]):
+            babyA[i] = parentA[i] if parentA[i] == target[i] else parentB[i]
+            babyB[i] = parentB[i] if parentB[i] == target[i] else parentA[i]
+
+    @njit(inline='always')
+    def _mutate(member, alphabet, log_keep):
+        """
+        Mutates a member in place
+        rather than drawing a random number per character, the gap to the next mutated character is drawn
+        from the geometric distribution, so the crossover loop stays free of random draws
+        log_keep is log(1 - mutation_rate), computed once per generation by the caller
+        """
+        if log_keep >= 0.0:
+            return
+        L = member.shape[0]
+        K = alphabet.shape[0]
+        i = -1
+        while True:
+            i += 1 + int(np.log(1.0 - np.random.random()) / log_keep)
+            if i >= L:
+                break
+            member[i] = alphabet[np.random.randint(0, K)]
+
+    @njit(inline='always')
+    def _load_word(row, start):
+        """
+        Packs 8 ASCII codes starting at start into one little-endian 64 bit word
+        """
+        word = np.uint64(0)
+        for j in range(8):
+            word |= np.uint64(row[start + j]) << np.uint64(8 * j)
+        return word
+
+    @njit
+    def _pack_words(target):
+        """
+        Packs the full 8 character words of the target, characters past the last full word are left out
+        """
+        n = target.shape[0] // 8
+        target_words = np.empty(n, dtype=np.uint64)
+        for w in range(n):
+            target_words[w] = _load_word(target, 8 * w)
+        return target_words
+
+    @njit(inline='always')
+    def _score_swar(member, target_words, target):
+        """
+        Fitness score of a single member, compared to the target 8 characters at a time
+        the XOR of a member word and a target word has a zero byte for every correctly placed character,
+        and those zero bytes are counted without branching
+        characters past the last full word are compared one at a time
+        """
+        low7 = np.uint64(0x7F7F7F7F7F7F7F7F)
+        ones = np.uint64(0x0101010101010101)
+        L = target.shape[0]
+        n = target_words.shape[0]
+        score = 0
+        for w in range(n):
+            v = _load_word(member, 8 * w) ^ target_words[w]
+            # high bit set in exactly the bytes of v that are zero
+            zero = ~(((v & low7) + low7) | v | low7)
+            # sum the high bits into the top byte
+            score += ((zero >> np.uint64(7)) * ones) >> np.uint64(56)
+        for i in range(8 * n, L):
+            score += member[i] == target[i]
+        return score / L
+
+    @njit(parallel=True, cache=True)
+    def _fitness_swar(pop, target, out):
+        """
+        Compiled kernel scoring the population 8 characters at a time with _score_swar
+
+        :param pop: population as ASCII codes
+        :type pop: np.ndarray
+        :param target: target string as ASCII codes
+        :type target: np.ndarray
+        :param out: fitness scores, filled in place
+        :type out: np.ndarray
+        """
+        target_words = _pack_words(target)
+        for k in prange(pop.shape[0]):
+            out[k] = _score_swar(pop[k], target_words, target)
+
+    @njit(parallel=True, cache=True)
+    def _evolve_step(pop, target, alphabet, cdf, mutation_rate, out_pop, out_fit):
+        """
+        Compiled kernel running reproduction, mutation and fitness for a whole generation in one pass
+        Each pair of parents is picked from the cumulative mating probabilities and makes two babies,
+        which are mutated and scored 8 characters at a time with _score_swar while they are still in cache
+
+        :param pop: current population as ASCII codes
+        :type pop: np.ndarray
+        :param target: target string as ASCII codes
+        :type target: np.ndarray
+        :param alphabet: ASCII codes to draw mutations from
+        :type alphabet: np.ndarray
+        :param cdf: cumulative mating probabilities of the current population
+        :type cdf: np.ndarray
+        :param mutation_rate: rate to mutate
+        :type mutation_rate: float
+        :param out_pop: new population, filled in place
+        :type out_pop: np.ndarray
+        :param out_fit: fitness scores of the new population, filled in place
+        :type out_fit: np.ndarray
+        """
+        P = cdf.shape[0]
+        total = cdf[P - 1]
+        log_keep = np.log(1.0 - mutation_rate) if mutation_rate < 1.0 else -np.inf
+        target_words = _pack_words(target)
+        for x in prange(out_pop.shape[0] // 2):
+            a = min(np.searchsorted(cdf, np.random.random() * total, side='right'), P - 1)
+            b = min(np.searchsorted(cdf, np.random.random() * total, side='right'), P - 1)
+            # redraw parentB once where it is the same member as parentA
+            if a == b:
+                b = min(np.searchsorted(cdf, np.random.random() * total, side='right'), P - 1)
+            babyA = out_pop[2 * x]
+            babyB = out_pop[2 * x + 1]
+            _crossover(pop[a], pop[b], target, babyA, babyB)
+            _mutate(babyA, alphabet, log_keep)
+            _mutate(babyB, alphabet, log_keep)
+            out_fit[2 * x] = _score_swar(babyA, target_words, target)
+            out_fit[2 * x + 1] = _score_swar(babyB, target_words, target)
+
+else:
+    _evolve_step = None
+    _fitness_swar = None
 
 
 class Evolution(object):
@@ -41,35 +173,60 @@ class Evolution(object):
     Class for Evoloving a population to reach the target string
 
     Attributes:
-        target  target string you wish to evolve to
+        target  target string you wish to evolve to, must only contain ASCII characters
         populationsize  size of population of each generation, default is 100
-        population      population of each generation, will change with evolution
+        elite           number of fittest members carried over unchanged to the next generation, default is 2
+        population      population of each generation as strings, will change with evolution
         fitness         fitness scores of the population
-        mating_pool     mating pool to generate new members of population
+        mating_probs    probability of each member being picked as a parent for the new generation
         generation      number to represent the generation you are on
         target_acquired boolean field, if true then the target was required
         max_fitness     current maximum fitness score of population
         target_population   the member of the population that is equal to the target string once evolution is completed
         closest_target  the current member of hte population that is closest to the target
     """
-    def __init__(self, target, populationsize=100):
+    def __init__(self, target, populationsize=100, seed=None, elite=2):
         """
 
-        :param target: target string
+        :param target: target string, must only contain ASCII characters
         :type target: str
         :param populationsize: size of initial population and subsequent new generations population, default is 100
         :type populationsize: int
+        :param seed: seed for the random generator, default is None for a fresh seed
+            a seeded Evolution always runs the NumPy path, the numba kernel's per thread random state can not be seeded
+        :type seed: int
+        :param elite: number of fittest members carried over unchanged to each new generation, default is 2
+        :type elite: int
         """
         self.target = target
         self.populationsize = populationsize
-        self.population = []
-        self.fitness = []
-        self.mating_pool = []
+        self.elite = elite
+        self._rng = np.random.default_rng(seed)
+        # only unseeded runs use the numba kernel, so seeded runs are reproducible
+        self._use_kernel = _evolve_step is not None and seed is None
+        try:
+            encoded = target.encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError("target must only contain ASCII characters") from None
+        self._target_arr = np.frombuffer(encoded, dtype=np.uint8)
+        # ASCII codes DNA elements are drawn from, duplicates keep the target's character frequencies
+        self._alphabet = self._target_arr.copy()
+        # population is stored as a (populationsize, len(target)) matrix of ASCII codes
+        self._pop = np.empty((populationsize, len(target)), dtype=np.uint8)
+        # which characters of the population already match the target, kept in step with _pop by
+        # reproduction and mutation so fitness does not have to compare every character again
+        # None when it has to be recomputed from _pop
+        self._match_mask = None
+        self.fitness = np.zeros(populationsize)
+        self.mating_probs = None
         self.generation = 1
         self.target_acquired = False
         self.max_fitness = None
         self.target_population = None
         self.closest_target = None
+        # progress tracking for adapt_mutation_rate
+        self._best_fitness = 0.0
+        self._stalled = 0
         # initialize population
         self.generate_initial_population()
         # initialize fitness scores
@@ -79,44 +236,54 @@ class Evolution(object):
         # check initial progress
         self.check_progress()
 
+    @property
+    def population(self):
+        """
+        Population of the current generation decoded back into strings
+
+        :rtype: list
+        """
+        # decode the whole matrix at once, then slice it into members
+        text = self._pop.tobytes().decode('ascii')
+        L = len(self.target)
+        return [text[i:i + L] for i in range(0, len(text), L)]
+
     def generate_initial_population(self):
         """
         Function to generate a population sized denoted as size
         population is of N generated random DNA elements
         N is the length of the target
         """
-        self.population = []
-        N = len(self.target)
-        for x in range(0, self.populationsize):
-            dna = generate_random_dna(N, self.target)
-            self.population.append(dna)
+        self._pop = generate_random_dna((self.populationsize, len(self.target)), self._alphabet, self._rng)
+        self._match_mask = None
 
     def generate_fitness(self):
         """
         Function to generate the fitness score of each population member
         fitness score is determined by the number of correctly placed characters in the string
         """
-        self.fitness = []
-        for member in self.population:
-            score = 0
-            for i in range(0, len(self.target)):
-                if member[i] == self.target[i]:
-                    score = score + 1
-            self.fitness.append(score / len(self.target))
+        if self._match_mask is not None:
+            self.fitness = np.count_nonzero(self._match_mask, axis=1) / len(self.target)
+        elif _fitness_swar is not None:
+            self.fitness = np.empty(len(self._pop))
+            _fitness_swar(self._pop, self._target_arr, self.fitness)
+        else:
+            self._match_mask = self._pop == self._target_arr
+            self.fitness = self._match_mask.mean(axis=1)
 
     def create_mating_pool(self):
         """
         Function to generate the mating pool
-        the matingpool will be generated from members of the population
-        a member will be added to the matingpool as determined by their fitness score %
-        for example: if a member has .5 fitness score, it will be added 50 times to the mating pool
+        the matingpool is the probability of each member of the population being picked as a parent
+        a member is weighted by their fitness score
+        for example: a member with .5 fitness score is twice as likely to be picked as one with .25 fitness score
+        if every member has a fitness score of 0, every member is equally likely to be picked
         """
-        self.mating_pool = []
-        for i, member in enumerate(self.population):
-            score = self.fitness[i]
-            n = int(np.rint(score * 100))
-            for j in range(0, n):
-                self.mating_pool.append(member)
+        total = self.fitness.sum()
+        if total > 0:
+            self.mating_probs = self.fitness / total
+        else:
+            self.mating_probs = np.full(len(self.fitness), 1.0 / len(self.fitness))
 
     def reproduction(self):
         """
@@ -125,26 +292,33 @@ class Evolution(object):
             The two parents will make 2 babies.
             The first will be the "best" parts from parentA and the rest from parentB
             the second will be the "best" parts from parentB and the rest from parentA
+            All pairs are drawn and crossed over at once
+            a baby matches the target wherever either parent did, so the match mask is carried over without
+            comparing the babies to the target
             """
-
-        self.population = []
-        for x in range(0, int(self.populationsize/2)):
-            parentA = np.random.choice(self.mating_pool)
-            other_parents = [member for member in self.mating_pool if member != parentA]
-            parentB = np.random.choice(other_parents)
-            babyA = ""
-            babyB = ""
-            for i in range(0, len(self.target)):
-                if parentA[i] == self.target[i]:
-                    babyA = babyA + parentA[i]
-                else:
-                    babyA = babyA + parentB[i]
-                if parentB[i] == self.target[i]:
-                    babyB = babyB + parentB[i]
-                else:
-                    babyB = babyB + parentA[i]
-            self.population.append(babyA)
-            self.population.append(babyB)
+        pop = self._pop
+        probs = self.mating_probs
+        rng = self._rng
+        P = len(probs)
+        pairs = int(self.populationsize/2)
+        a = rng.choice(P, size=pairs, p=probs, shuffle=False)
+        b = rng.choice(P, size=pairs, p=probs, shuffle=False)
+        # redraw parentB once where it is the same member as parentA
+        collisions = a == b
+        b[collisions] = rng.choice(P, size=collisions.sum(), p=probs, shuffle=False)
+        match = self._match_mask if self._match_mask is not None else pop == self._target_arr
+        parentsA = pop[a]
+        parentsB = pop[b]
+        matchA = match[a]
+        matchB = match[b]
+        new_pop = np.empty((2 * pairs, pop.shape[1]), dtype=np.uint8)
+        new_pop[0::2] = np.where(matchA, parentsA, parentsB)
+        new_pop[1::2] = np.where(matchB, parentsB, parentsA)
+        new_match = np.empty(new_pop.shape, dtype=bool)
+        new_match[0::2] = matchA | matchB
+        new_match[1::2] = new_match[0::2]
+        self._pop = new_pop
+        self._match_mask = new_match
 
     def mutation(self, mutation_rate=0.01):
         """
@@ -157,17 +331,18 @@ class Evolution(object):
         :param mutation_rate: rate to mutate
         :type mutation_rate: float
         """
-        new_population = []
-        for member in self.population:
-            dna_out = ""
-            for i in range(0, len(member)):
-                mutation = np.random.choice(['mutate', 'no_mutate'], p=[mutation_rate, 1 - mutation_rate])
-                if mutation == 'mutate':
-                    dna_out = dna_out + generate_random_dna(1, self.target)
-                else:
-                    dna_out = dna_out + member[i]
-            new_population.append(dna_out)
-        self.population = new_population
+        # drawing how many characters mutate and then which ones is the same as deciding every character
+        # separately, but only touches the mutated characters
+        pop = self._pop
+        rng = self._rng
+        n = rng.binomial(pop.size, mutation_rate)
+        sites = rng.choice(pop.size, size=n, replace=False, shuffle=False)
+        rows, cols = np.divmod(sites, pop.shape[1])
+        mutated = generate_random_dna(n, self._alphabet, rng)
+        pop[rows, cols] = mutated
+        if self._match_mask is not None:
+            # only the mutated characters can have changed whether they match
+            self._match_mask[rows, cols] = mutated == self._target_arr[cols]
 
     def check_progress(self):
         """
@@ -176,9 +351,9 @@ class Evolution(object):
         closet_target will be the member of the population that has the highest score
 
         """
-        self.max_fitness = max(self.fitness)
-        index = self.fitness.index(self.max_fitness)
-        self.closest_target = self.population[index]
+        index = int(self.fitness.argmax())
+        self.max_fitness = float(self.fitness[index])
+        self.closest_target = self._pop[index].tobytes().decode('ascii')
         if self.max_fitness == 1.0:
             self.target_acquired = True
             self.target_population = self.closest_target
@@ -186,39 +361,95 @@ class Evolution(object):
     def new_generation(self, mutation_rate=0.01):
         """
         Function to create a new generation
+        when numba is installed and no seed was given, reproduction, mutation and fitness run as one compiled kernel
+        the elite members of the old generation replace the least fit babies, keeping their fitness scores
 
+        :param mutation_rate: rate to mutate, between 0 and 1
+        :type mutation_rate: float
         """
-        self.reproduction()
-        self.mutation(mutation_rate)
-        self.generate_fitness()
+        if not 0 <= mutation_rate <= 1:
+            raise ValueError("mutation_rate must be between 0 and 1")
+        pairs = int(self.populationsize/2)
+        K = min(self.elite, 2 * pairs)
+        if K > 0:
+            elite_idx = np.argpartition(-self.fitness, K - 1)[:K]
+            elite_pop = self._pop[elite_idx]
+            elite_fit = self.fitness[elite_idx]
+        if self._use_kernel:
+            new_pop = np.empty((2 * pairs, len(self.target)), dtype=np.uint8)
+            self.fitness = np.empty(2 * pairs)
+            _evolve_step(self._pop, self._target_arr, self._alphabet, np.cumsum(self.mating_probs),
+                         mutation_rate, new_pop, self.fitness)
+            self._pop = new_pop
+            self._match_mask = None
+        else:
+            self.reproduction()
+            self.mutation(mutation_rate)
+            self.generate_fitness()
+        if K > 0:
+            worst = np.argpartition(self.fitness, K - 1)[:K]
+            self._pop[worst] = elite_pop
+            self.fitness[worst] = elite_fit
+            if self._match_mask is not None:
+                self._match_mask[worst] = elite_pop == self._target_arr
         self.check_progress()
         self.create_mating_pool()
         self.generation = self.generation + 1
 
 
-    def evolution_rounds(self, rounds, mutation_rate=0.01):
+    def adapt_mutation_rate(self, mutation_rate, base_rate=0.01):
+        """
+        Function to adapt the mutation rate to the progress of evolution
+        while the max fitness keeps improving, the base rate is used
+        after every 50 generations without improvement, the rate is raised by 25%,
+        up to twice the base rate and never above 1
+
+        :param mutation_rate: rate used for the last generation
+        :type mutation_rate: float
+        :param base_rate: rate to return to once the max fitness improves
+        :type base_rate: float
+        :return: rate to use for the next generation
+        :rtype: float
+        """
+        if self.max_fitness > self._best_fitness:
+            self._best_fitness = self.max_fitness
+            self._stalled = 0
+            return base_rate
+        self._stalled = self._stalled + 1
+        if self._stalled >= 50:
+            self._stalled = 0
+            return min(mutation_rate * 1.25, 2 * base_rate, 1.0)
+        return mutation_rate
+
+    def evolution_rounds(self, rounds, mutation_rate=0.01, adaptive=False):
         """
         Function to generate rounds of evolution
         main driver of the genetic algorithm class
-        evolution_rounds will stop when the target is acquired
+        evolution_rounds will stop when the target is acquired, no rounds are run if it already was
 
         :param rounds: rounds of evolution
         :type rounds: int
         :param mutation_rate: rate for mutation
         :type mutation_rate: float
+        :param adaptive: if true, the mutation rate is adapted with adapt_mutation_rate, starting from mutation_rate
+        :type adaptive: bool
 
         """
-        pbar = tqdm(total=rounds, desc="Generations")
+        rate = mutation_rate
+        # redraw the bar at most about 200 times per run, generations are often faster than a terminal refresh
+        pbar = tqdm(total=rounds, desc="Generations", miniters=max(1, rounds // 200), mininterval=0.2, smoothing=0)
         for i in range(0, rounds):
-            self.new_generation(mutation_rate)
-            pbar.update(1)
             if self.target_acquired:
-                pbar.close()
-                print("Target Acquired: ", self.target_population)
-                print("Generation acquired:", self.generation)
                 break
+            self.new_generation(rate)
+            if adaptive:
+                rate = self.adapt_mutation_rate(rate, mutation_rate)
+            pbar.update(1)
         pbar.close()
-        if not self.target_acquired:
+        if self.target_acquired:
+            print("Target Acquired: ", self.target_population)
+            print("Generation acquired:", self.generation)
+        else:
             print("Need more evolution rounds!")
             print("Closest to target: ", self.closest_target)
             print("Max Population Fitness: {:.2%}".format(self.max_fitness))